@@ -1,14 +1,17 @@
+import functools
 import os
 import json
 import re
 import sys
+import weakref
 from typing import Any, Dict, List, Optional, Tuple
 
 import anyio
+import anyio.abc
+import orjson
 import requests
 from dotenv import load_dotenv
 from loguru import logger
-from contextlib import AsyncExitStack
 
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
@@ -18,21 +21,33 @@ load_dotenv()
 NAV_URL = "https://api.ai.it.ufl.edu/v1/chat/completions"
 MODEL = os.getenv("NAV_MODEL", "granite-3.3-8b-instruct")
 
+# Set PIPELINE_SUMMARY_ONLY=1 to skip transform/load and let Socrata do the counting
+SUMMARY_ONLY = os.getenv("PIPELINE_SUMMARY_ONLY") == "1"
+SUMMARY_GROUP_BY = "narrative"
+
 DEFAULT_TABLE = "incidents"
 DEFAULT_LIMIT = 500
 DEFAULT_OFFSET = 0
 
-DEFAULT_CATEGORIES = [
-    "THEFT/PROPERTY",
-    "ASSAULT/VIOLENCE",
-    "DRUG/ALCOHOL",
-    "TRAFFIC",
-    "BURGLARY",
-    "OTHER",
-]
+# Interned: names with "/" aren't auto-interned by CPython, and these recur as dict values
+DEFAULT_CATEGORIES = tuple(
+    sys.intern(c)
+    for c in (
+        "THEFT/PROPERTY",
+        "ASSAULT/VIOLENCE",
+        "DRUG/ALCOHOL",
+        "TRAFFIC",
+        "BURGLARY",
+        "OTHER",
+    )
+)
 
 
 # ---------------- NavigatorAI (optional) ----------------
+# Reused across calls so repeat requests skip the TCP/TLS handshake
+_HTTP = requests.Session()
+
+
 def call_llm(messages: List[Dict[str, str]]) -> str:
     api_key = os.getenv("NAVIGATOR_API_KEY")
     if not api_key:
@@ -40,19 +55,35 @@ def call_llm(messages: List[Dict[str, str]]) -> str:
 
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     payload = {"model": MODEL, "messages": messages}
-    r = requests.post(NAV_URL, headers=headers, json=payload, timeout=60)
+    r = _HTTP.post(NAV_URL, headers=headers, json=payload, timeout=60)
     r.raise_for_status()
     return r.json()["choices"][0]["message"]["content"]
 
 
 # ---------------- JSON helpers ----------------
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{.*\}|\[.*\])\s*```", flags=re.DOTALL)
+
+
 def _try_json_loads(s: str) -> Any:
     try:
-        return json.loads(s)
+        return orjson.loads(s)
     except Exception:
         return None
 
 
+# Small payloads (schema, anomaly report, summaries) get re-parsed across the run
+_LOADS_CACHE_MAX_LEN = 4096
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_loads(s: str) -> Any:
+    """
+    Memoized _try_json_loads() keyed on the string itself.
+    Results are shared between callers, so treat them as read-only.
+    """
+    return _try_json_loads(s)
+
+
 def try_parse_json(text: Any) -> Any:
     if text is None:
         return None
@@ -63,11 +94,12 @@ def try_parse_json(text: Any) -> Any:
     if not s:
         return s
 
-    parsed = _try_json_loads(s)
+    parsed = _cached_loads(s) if len(s) < _LOADS_CACHE_MAX_LEN else _try_json_loads(s)
     if parsed is not None:
         return parsed
 
-    m = re.search(r"```(?:json)?\s*(\{.*\}|\[.*\])\s*```", s, flags=re.DOTALL)
+    # Only LLM replies wrapped in a ``` fence can match; skip the regex otherwise
+    m = _FENCED_JSON_RE.search(s) if "```" in s else None
     if m:
         parsed = _try_json_loads(m.group(1))
         if parsed is not None:
@@ -81,15 +113,28 @@ def ensure_list(data: Any, ctx: str) -> List[Dict[str, Any]]:
     Ensures the object is a list of dicts.
     Raises with a helpful error if not.
     """
-    data = try_parse_json(data)
+    # Already-parsed lists skip the try_parse_json round trip
+    if not isinstance(data, (list, dict)):
+        data = try_parse_json(data)
     if isinstance(data, list):
         # also allow list of primitives, but we expect dicts
-        if data and not isinstance(data[0], dict):
-            raise ValueError(f"{ctx}: Expected list of objects (dicts), got list of {type(data[0])}")
-        return data
+        if not data or isinstance(data[0], dict):
+            return data
+        raise ValueError(f"{ctx}: Expected list of objects (dicts), got list of {type(data[0])}")
     raise ValueError(f"{ctx}: Expected JSON list, got {type(data)}: {str(data)[:200]}")
 
 
+def ensure_list_text(text: str, ctx: str) -> str:
+    """
+    Like ensure_list(), but for a raw JSON string that is forwarded to the next tool as-is.
+    A list body is passed through unparsed; anything else is parsed only to raise the usual error.
+    """
+    if text.lstrip()[:1] == "[":
+        return text
+    ensure_list(text, ctx)
+    return text
+
+
 def pretty(obj: Any) -> str:
     try:
         return json.dumps(obj, indent=2, ensure_ascii=False)
@@ -98,16 +143,76 @@ def pretty(obj: Any) -> str:
 
 
 # ---------------- MCP client helpers ----------------
-async def start_server_session(stack: AsyncExitStack, py_file: str) -> ClientSession:
+# Environment handed to server subprocesses; built once instead of copying os.environ per spawn.
+# If a server starts reading another variable, list it here.
+_SERVER_ENV_KEYS = (
+    "PATH",
+    "HOME",
+    "LANG",
+    "LC_ALL",
+    "PYTHONPATH",
+    "VIRTUAL_ENV",
+    "TMPDIR",
+    "LD_LIBRARY_PATH",  # HPC module setups (e.g. HiPerGator) point Python/sqlite libs here
+    "SYSTEMROOT",  # required by Python on Windows
+    "TEMP",
+    "TMP",
+    "NAVIGATOR_API_KEY",
+    "NAV_MODEL",
+    "MCP_PRETTY_JSON",  # indented tool output from the transform server, for debugging
+    # proxies / CA bundles so the extract server can reach Socrata on managed networks
+    "HTTP_PROXY",
+    "HTTPS_PROXY",
+    "NO_PROXY",
+    "http_proxy",
+    "https_proxy",
+    "no_proxy",
+    "REQUESTS_CA_BUNDLE",
+    "CURL_CA_BUNDLE",  # requests honors this too
+    "SSL_CERT_FILE",
+    "SSL_CERT_DIR",
+)
+_SERVER_ENV = {k: os.environ[k] for k in _SERVER_ENV_KEYS if k in os.environ}
+
+
+async def serve_server(
+    py_file: str,
+    stop: anyio.Event,
+    *,
+    task_status: anyio.abc.TaskStatus[ClientSession] = anyio.TASK_STATUS_IGNORED,
+) -> None:
+    """
+    Own one server's lifetime: spawn it, run the MCP handshake, hand the session
+    back via task_status, then keep it open until `stop` is set (or we are cancelled).
+    Running each server in its own task lets startup and teardown overlap.
+    """
     params = StdioServerParameters(
         command=sys.executable,
         args=[py_file],
-        env=os.environ.copy(),
+        env=_SERVER_ENV,
     )
-    read, write = await stack.enter_async_context(stdio_client(params))
-    session = await stack.enter_async_context(ClientSession(read, write))
-    await session.initialize()
-    return session
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            task_status.started(session)
+            await stop.wait()
+
+
+async def start_servers(tg: anyio.abc.TaskGroup, stop: anyio.Event, *py_files: str) -> List[ClientSession]:
+    """
+    Start every server in `tg` concurrently and return their sessions in argument order.
+    Each handshake mostly waits on the child interpreter importing its deps, so
+    overlapping them makes startup cost the slowest server instead of the sum.
+    """
+    sessions: List[Optional[ClientSession]] = [None] * len(py_files)
+
+    async def _start(i: int, py_file: str) -> None:
+        sessions[i] = await tg.start(serve_server, py_file, stop)
+
+    async with anyio.create_task_group() as starters:
+        for i, py_file in enumerate(py_files):
+            starters.start_soon(_start, i, py_file)
+    return sessions
 
 
 async def call_tool(session: ClientSession, tool_name: str, args: Optional[Dict[str, Any]] = None) -> Any:
@@ -120,49 +225,105 @@ async def call_tool(session: ClientSession, tool_name: str, args: Optional[Dict[
     return try_parse_json(text)
 
 
+async def call_tool_raw(session: ClientSession, tool_name: str, args: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Same as call_tool() but returns the tool's text output unparsed,
+    for payloads that are only handed on to another tool.
+    """
+    args = args or {}
+    result = await session.call_tool(tool_name, args)
+    try:
+        return result.content[0].text
+    except Exception:
+        return str(getattr(result, "content", result))
+
+
+# Schema is static per server, so remember it per session (weak keys: no stale id() reuse)
+_SCHEMA_CACHE: "weakref.WeakKeyDictionary[ClientSession, Any]" = weakref.WeakKeyDictionary()
+
+
 async def read_schema(session: ClientSession) -> Any:
     """
     Prefer resource schema://incidents (per assignment spec).
     Fallback to tool get_schema if you implemented it.
+    Successful reads are cached per session.
     """
+    if session in _SCHEMA_CACHE:
+        return _SCHEMA_CACHE[session]
+
     # Try resource first
     try:
         res = await session.read_resource("schema://incidents")
         # res.contents is typically a list; each item may have .text
         try:
             txt = res.contents[0].text
-            return try_parse_json(txt)
+            schema = try_parse_json(txt)
         except Exception:
-            return try_parse_json(res)
+            schema = try_parse_json(res)
+        _SCHEMA_CACHE[session] = schema
+        return schema
     except Exception:
         pass
 
     # Fallback to tool name
     try:
-        return await call_tool(session, "get_schema", {})
+        schema = await call_tool(session, "get_schema", {})
+        _SCHEMA_CACHE[session] = schema
+        return schema
     except Exception as e:
         return f"Schema unavailable (no resource schema://incidents and no get_schema tool). Error: {e}"
 
 
-# ---------------- Planning ----------------
-def build_llm_plan_prompt(schema: Any, anomalies: Any) -> str:
-    return f"""
-You are a data engineer orchestrator.
+async def run_queries(session: ClientSession, queries: List[str]) -> List[Dict[str, Any]]:
+    """
+    Send all read-only queries to the load server at once and keep results in query order.
+    The load server serializes them on its pooled read-only connection, so overlapping calls are safe.
+    """
+    results: List[Dict[str, Any]] = [{"sql": q, "result": None} for q in queries]
 
-Given the schema and anomaly report, choose SAFE fetch parameters only.
+    async def _run(i: int, q: str) -> None:
+        try:
+            results[i]["result"] = await call_tool(session, "query_database", {"sql": q})
+        except Exception as e:
+            results[i]["result"] = [{"error": f"{type(e).__name__}: {e}"}]
 
-Schema:
-{schema}
+    async with anyio.create_task_group() as tg:
+        for i, q in enumerate(queries):
+            tg.start_soon(_run, i, q)
+    return results
 
-Anomaly report:
-{anomalies}
 
-Return ONLY JSON with keys:
+# ---------------- Planning ----------------
+_PROMPT_HEADER = """You are a data engineer orchestrator.
+
+Given the schema and anomaly report, choose SAFE fetch parameters only."""
+
+_PROMPT_FOOTER = """Return ONLY JSON with keys:
 - fetch_limit (int, 100..2000)
 - fetch_offset (int, >=0)
 
-Return JSON only. No extra keys.
-""".strip()
+Return JSON only. No extra keys."""
+
+
+def _compact(obj: Any) -> str:
+    """
+    Compact JSON for prompt embedding; Python's repr of dicts is noticeably more tokens.
+    """
+    if isinstance(obj, str):
+        return obj
+    try:
+        return orjson.dumps(obj).decode()
+    except TypeError:
+        return str(obj)
+
+
+def build_llm_plan_prompt(schema: Any, anomalies: Any) -> str:
+    return (
+        f"{_PROMPT_HEADER}\n\n"
+        f"Schema:\n{_compact(schema)}\n\n"
+        f"Anomaly report:\n{_compact(anomalies)}\n\n"
+        f"{_PROMPT_FOOTER}"
+    )
 
 
 def sanitize_plan(plan: Any) -> Tuple[int, int]:
@@ -186,94 +347,152 @@ def sanitize_plan(plan: Any) -> Tuple[int, int]:
     return limit, offset
 
 
+# Summary query templates; at most one of each is emitted, so the list never exceeds 4
+_Q_COUNT = "SELECT COUNT(*) AS total_rows FROM {t};"
+_Q_GROUP = "SELECT {c}, COUNT(*) AS n FROM {t} GROUP BY {c} ORDER BY n DESC LIMIT 10;"
+_Q_DATE_RANGE = "SELECT MIN({c}) AS min_date, MAX({c}) AS max_date FROM {t};"
+
+# common date fields in Socrata datasets vary; first one present wins
+DATE_COLS = ("report_date", "offense_date", "report_datetime", "offense_datetime")
+
+
 def build_safe_queries(sample_rows: List[Dict[str, Any]], table: str) -> List[str]:
     """
     Build queries based on actual columns present.
     """
-    cols = set(sample_rows[0].keys()) if sample_rows else set()
-
-    queries = [f"SELECT COUNT(*) AS total_rows FROM {table};"]
-
-    if "category" in cols:
-        queries.append(
-            f"SELECT category, COUNT(*) AS n FROM {table} GROUP BY category ORDER BY n DESC LIMIT 10;"
-        )
+    # dict_keys already supports O(1) membership; no need to copy into a set
+    cols = sample_rows[0].keys() if sample_rows else ()
 
-    if "incident_type" in cols:
-        queries.append(
-            f"SELECT incident_type, COUNT(*) AS n FROM {table} GROUP BY incident_type ORDER BY n DESC LIMIT 10;"
-        )
+    queries = [_Q_COUNT.format(t=table)]
 
-    # common date fields in Socrata datasets vary; include if present
-    date_col = None
-    for c in ["report_date", "offense_date", "report_datetime", "offense_datetime"]:
+    for c in ("category", "incident_type"):
         if c in cols:
-            date_col = c
-            break
+            queries.append(_Q_GROUP.format(c=c, t=table))
+
+    date_col = next((c for c in DATE_COLS if c in cols), None)
     if date_col:
-        queries.append(
-            f"SELECT MIN({date_col}) AS min_date, MAX({date_col}) AS max_date FROM {table};"
-        )
+        queries.append(_Q_DATE_RANGE.format(c=date_col, t=table))
+
+    return queries
 
-    return queries[:6]
+
+async def plan_fetch(schema: Any, anomalies: Any) -> Tuple[int, int]:
+    """
+    Ask the LLM for limit/offset (if NAVIGATOR_API_KEY is set), falling back to defaults.
+    The blocking HTTP call runs in a worker thread so the event loop keeps serving MCP I/O.
+    """
+    if not os.getenv("NAVIGATOR_API_KEY"):
+        return DEFAULT_LIMIT, DEFAULT_OFFSET
+
+    messages = [{"role": "user", "content": build_llm_plan_prompt(schema, anomalies)}]
+    try:
+        llm_out = await anyio.to_thread.run_sync(call_llm, messages)
+        limit, offset = sanitize_plan(try_parse_json(llm_out))
+        logger.info(f"Using LLM fetch plan: limit={limit}, offset={offset}")
+        return limit, offset
+    except Exception as e:
+        logger.warning(f"LLM planning failed; using default limit/offset. Error: {e}")
+        return DEFAULT_LIMIT, DEFAULT_OFFSET
 
 
 # ---------------- Pipeline ----------------
+async def run_summary_only(extract: ClientSession) -> None:
+    """
+    Explore-only path: per-type counts are aggregated by Socrata ($group),
+    so no rows are downloaded, transformed or loaded.
+    """
+    schema = await read_schema(extract)
+    counts = await call_tool(extract, "aggregate_incidents", {"group_by": SUMMARY_GROUP_BY})
+
+    print("\n================ SUMMARY REPORT ================\n")
+    print("SCHEMA:")
+    print(pretty(schema))
+    print(f"\nCOUNTS BY {SUMMARY_GROUP_BY}:")
+    print(pretty(counts))
+    print("\n=================================================\n")
+
+    logger.info("Summary complete ✅")
+
+
 async def run_pipeline() -> None:
     logger.info("Starting MCP pipeline (stdio) ...")
 
-    async with AsyncExitStack() as stack:
-        extract = await start_server_session(stack, "servers/extract_server.py")
-        transform = await start_server_session(stack, "servers/transform_server.py")
-        load = await start_server_session(stack, "servers/load_server.py")
+    # Each server lives in its own task: setting `stop` shuts them all down in parallel,
+    # and an error anywhere below cancels the group, tearing all three down at once.
+    stop = anyio.Event()
+    async with anyio.create_task_group() as tg:
+        if SUMMARY_ONLY:
+            (extract,) = await start_servers(tg, stop, "servers/extract_server.py")
+            logger.info("Connected to extract server (summary only).")
+            await run_summary_only(extract)
+            stop.set()
+            return
+
+        extract, transform, load = await start_servers(
+            tg,
+            stop,
+            "servers/extract_server.py",
+            "servers/transform_server.py",
+            "servers/load_server.py",
+        )
         logger.info("Connected to extract/transform/load servers.")
 
         schema = await read_schema(extract)
 
-        # Sample always from fetch_incidents (tool must exist per spec)
-        sample_raw = await call_tool(extract, "fetch_incidents", {"limit": 100, "offset": 0})
-        sample = ensure_list(sample_raw, "fetch_incidents(sample)")
+        # Sample always from fetch_incidents (tool must exist per spec).
+        # Row payloads are forwarded between servers as the raw JSON text each tool
+        # returned, so we don't parse + re-encode the whole batch on every hop.
+        sample_text = await call_tool_raw(extract, "fetch_incidents", {"limit": 100, "offset": 0})
+        sample_text = ensure_list_text(sample_text, "fetch_incidents(sample)")
         logger.info("Got schema + sample.")
 
         # Anomalies must receive JSON list string
-        anomalies_raw = await call_tool(transform, "detect_anomalies", {"data": json.dumps(sample)})
+        anomalies_raw = await call_tool(transform, "detect_anomalies", {"data": sample_text})
         anomalies = try_parse_json(anomalies_raw)
         logger.info("Anomaly report created.")
 
-        # Optional: let LLM suggest ONLY limit/offset
-        limit, offset = DEFAULT_LIMIT, DEFAULT_OFFSET
-        if os.getenv("NAVIGATOR_API_KEY"):
-            try:
-                llm_out = call_llm([{"role": "user", "content": build_llm_plan_prompt(schema, anomalies)}])
-                llm_plan = try_parse_json(llm_out)
-                limit, offset = sanitize_plan(llm_plan)
-                logger.info(f"Using LLM fetch plan: limit={limit}, offset={offset}")
-            except Exception as e:
-                logger.warning(f"LLM planning failed; using default limit/offset. Error: {e}")
-
         table_name = DEFAULT_TABLE
         categories = DEFAULT_CATEGORIES
 
+        # Optional: let LLM suggest ONLY limit/offset. While it thinks, speculatively
+        # fetch the default batch; it is kept if the LLM picks the default plan and
+        # cancelled otherwise, so the real fetch never waits behind it.
+        speculative: Dict[str, str] = {}
+
+        async def _fetch_default_batch() -> None:
+            speculative["text"] = await call_tool_raw(
+                extract, "fetch_incidents", {"limit": DEFAULT_LIMIT, "offset": DEFAULT_OFFSET}
+            )
+
+        async with anyio.create_task_group() as spec_tg:
+            spec_tg.start_soon(_fetch_default_batch)
+            limit, offset = await plan_fetch(schema, anomalies)
+            if (limit, offset) != (DEFAULT_LIMIT, DEFAULT_OFFSET):
+                spec_tg.cancel_scope.cancel()
+
         logger.info(f"Plan: limit={limit}, offset={offset}, table={table_name}")
 
         # Fetch real batch
-        raw_batch = await call_tool(extract, "fetch_incidents", {"limit": limit, "offset": offset})
-        incidents = ensure_list(raw_batch, "fetch_incidents(full)")
+        if (limit, offset) == (DEFAULT_LIMIT, DEFAULT_OFFSET):
+            batch_text = speculative["text"]
+        else:
+            batch_text = await call_tool_raw(extract, "fetch_incidents", {"limit": limit, "offset": offset})
+        batch_text = ensure_list_text(batch_text, "fetch_incidents(full)")
 
         # Transform
-        cleaned_raw = await call_tool(transform, "clean_dates", {"data": json.dumps(incidents)})
-        cleaned = ensure_list(cleaned_raw, "clean_dates")
+        cleaned_text = await call_tool_raw(transform, "clean_dates", {"data": batch_text})
+        cleaned_text = ensure_list_text(cleaned_text, "clean_dates")
 
-        categorized_raw = await call_tool(
+        categorized_text = await call_tool_raw(
             transform,
             "categorize_incidents",
-            {"data": json.dumps(cleaned), "categories": categories},
+            {"data": cleaned_text, "categories": categories},
         )
-        categorized = ensure_list(categorized_raw, "categorize_incidents")
+        categorized_text = ensure_list_text(categorized_text, "categorize_incidents")
         logger.info("Transform complete (clean_dates + categorize_incidents).")
 
         # Load
-        save_msg = await call_tool(load, "save_to_sqlite", {"data": json.dumps(categorized), "table_name": table_name})
+        save_msg = await call_tool(load, "save_to_sqlite", {"data": categorized_text, "table_name": table_name})
 
         # If save failed, STOP and show report (don’t pretend pipeline succeeded)
         if isinstance(save_msg, str) and save_msg.lower().startswith("error"):
@@ -282,11 +501,10 @@ async def run_pipeline() -> None:
         summary = await call_tool(load, "generate_summary", {"table_name": table_name})
 
         # Build safe queries from real columns
+        # Only place the final rows are inspected in-process
+        categorized = ensure_list(categorized_text, "categorize_incidents")
         safe_queries = build_safe_queries(categorized[:1], table_name)
-        query_results = []
-        for q in safe_queries:
-            out = await call_tool(load, "query_database", {"sql": q})
-            query_results.append({"sql": q, "result": out})
+        query_results = await run_queries(load, safe_queries)
 
         print("\n================ PIPELINE REPORT ================\n")
         print("PLAN:")
@@ -304,10 +522,21 @@ async def run_pipeline() -> None:
         print("\n=================================================\n")
 
         logger.info("Pipeline complete ✅")
+        stop.set()
+
+
+def _unwrap(exc: BaseException) -> BaseException:
+    """Peel single-member exception groups added by the task groups down to the real error."""
+    while isinstance(exc, BaseExceptionGroup) and len(exc.exceptions) == 1:
+        exc = exc.exceptions[0]
+    return exc
 
 
 def main():
-    anyio.run(run_pipeline)
+    try:
+        anyio.run(run_pipeline)
+    except* Exception as eg:
+        raise _unwrap(eg) from None
 
 
 if __name__ == "__main__":
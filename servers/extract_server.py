@@ -1,31 +1,130 @@
 from __future__ import annotations
 
-import json
+import atexit
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 
+import ijson
+import orjson
 import requests
 from loguru import logger
 from mcp.server.fastmcp import FastMCP
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 MCP = FastMCP("extract_server")
 
 # Gainesville Crime Responses dataset (Socrata)
 SODA_URL = "https://data.cityofgainesville.org/resource/gvua-xt9q.json"
 
+# One pooled session per server process so repeated tool calls reuse the TCP/TLS connection
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        # raise_on_status=False hands the last 5xx back to raise_for_status() below
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False,
+        ),
+    ),
+)
+atexit.register(_SESSION.close)
+
+# Socrata's per-request row cap; validation errors are constant, so encode them once
+MAX_LIMIT = 2000
+_ERR_LIMIT = orjson.dumps({"ok": False, "error": f"limit must be between 1 and {MAX_LIMIT}"}).decode()
+_ERR_OFFSET = orjson.dumps({"ok": False, "error": "offset must be >= 0"}).decode()
+
+# The dataset's own columns (as returned by the live API), minus Socrata's
+# ":@computed_region_*" columns; sent as $select so Socrata skips those.
+# narrative is the text field categorize_incidents / detect_anomalies read.
+DEFAULT_FIELDS = (
+    "id",
+    "narrative",
+    "report_date",
+    "offense_date",
+    "report_hour_of_day",
+    "report_day_of_week",
+    "offense_hour_of_day",
+    "offense_day_of_week",
+    "city",
+    "state",
+    "address",
+    "latitude",
+    "longitude",
+    "location",
+)
+_SELECT = ",".join(DEFAULT_FIELDS)
+
+# Columns aggregate_incidents() may group by; anything else is rejected (it's spliced into SoQL)
+AGGREGATE_COLUMNS = (
+    "narrative",
+    "address",
+    "city",
+    "report_day_of_week",
+    "report_hour_of_day",
+    "offense_day_of_week",
+    "offense_hour_of_day",
+)
+
+# $select lists Socrata rejected (400, e.g. after a column rename); those calls fall back to all columns
+_REJECTED_SELECTS: set[str] = set()
+
+# Requests above CHUNK_SIZE rows are split into pages fetched in parallel over the pooled session
+CHUNK_SIZE = 1000
+_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="soda")
+
+# Above this $limit the response is decoded row-by-row off the socket instead of buffered whole
+STREAM_MIN_LIMIT = 500
+
+
+def _stream_rows(r: requests.Response) -> List[Dict[str, Any]]:
+    """
+    Decode a streamed JSON array response one row at a time with ijson.
+    Avoids holding the full body and the parsed rows in memory together.
+    """
+    try:
+        # r.raw is the undecoded socket stream; let urllib3 undo gzip for us
+        r.raw.decode_content = True
+        # use_float=True: ijson defaults to Decimal, which orjson can't serialize
+        events = ijson.parse(r.raw, use_float=True)
+        first = next(events, None)
+        if first is None or first[1] != "start_array":
+            raise ValueError("Unexpected response: expected a JSON list")
+        return list(ijson.items(itertools.chain([first], events), "item"))
+    finally:
+        r.close()
+
 
 def _http_get(params: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     HTTP GET helper.
 
     IMPORTANT (for tests):
-    - In unit tests, requests.get() is mocked and may not provide a numeric status_code.
+    - In unit tests, _SESSION.get() is mocked and may not provide a numeric status_code.
     - So we rely on raise_for_status() instead of comparing status_code >= 400.
     """
     try:
-        r = requests.get(SODA_URL, params=params, timeout=30)
+        stream = int(params.get("$limit", 0)) > STREAM_MIN_LIMIT
+        r = _SESSION.get(SODA_URL, params=params, timeout=30, stream=stream)
         # Works both in real requests and in mocked tests
         r.raise_for_status()
-        data = r.json()
+        if stream:
+            try:
+                data = _stream_rows(r)
+            except (AttributeError, TypeError, ValueError, ijson.JSONError) as e:
+                # r.raw isn't a usable byte stream (or didn't decode); use the buffered body
+                logger.warning(f"Streaming decode failed ({e}); parsing buffered response")
+                data = orjson.loads(r.content)
+        else:
+            # Parse the raw body directly; avoids requests' decode-to-str step
+            data = orjson.loads(r.content)
         if not isinstance(data, list):
             raise ValueError("Unexpected response: expected a JSON list")
         return data
@@ -40,28 +139,75 @@ def _http_get(params: Dict[str, Any]) -> List[Dict[str, Any]]:
         raise
 
 
+_SCHEMA = {
+    "source": SODA_URL,
+    "notes": "Field names are defined by the Socrata dataset and may evolve. Use fetch_incidents() to inspect live keys.",
+    "expected_common_fields": [
+        "incident_type",
+        "report_date",
+        "offense_date",
+        "case_number",
+        "location",
+        "latitude",
+        "longitude",
+        "status",
+    ],
+    "pagination": {
+        "limit_param": "$limit",
+        "offset_param": "$offset",
+        "max_limit": MAX_LIMIT,
+    },
+}
+# Static, so serialize once at import instead of on every resource read
+_SCHEMA_JSON = orjson.dumps(_SCHEMA, option=orjson.OPT_INDENT_2).decode()
+
+
+def _http_get_chunked(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    _http_get() that splits a large $limit into CHUNK_SIZE pages fetched concurrently.
+    params must carry a $order (see _http_get_select) so pages tile the result without
+    gaps/overlap; rows keep page order.
+    """
+    limit = int(params.get("$limit", 0))
+    if limit <= CHUNK_SIZE:
+        return _http_get(params)
+
+    offset = int(params.get("$offset", 0))
+    pages = [
+        {
+            **params,
+            "$limit": min(CHUNK_SIZE, limit - start),
+            "$offset": offset + start,
+        }
+        for start in range(0, limit, CHUNK_SIZE)
+    ]
+    rows: List[Dict[str, Any]] = []
+    for part in _POOL.map(_http_get, pages):
+        rows.extend(part)
+    return rows
+
+
+def _http_get_select(params: Dict[str, Any], select: str = _SELECT) -> List[Dict[str, Any]]:
+    """
+    _http_get() with a $select column list, retrying once without it if the API rejects the columns.
+    Row fetches are always ordered by :id, so a given $offset selects the same rows
+    whatever the $limit, and pages from separate calls tile.
+    """
+    params = {"$order": ":id", **params}
+    if select not in _REJECTED_SELECTS:
+        try:
+            return _http_get_chunked({**params, "$select": select})
+        except requests.HTTPError as e:
+            if getattr(getattr(e, "response", None), "status_code", None) != 400:
+                raise
+            logger.warning(f"Socrata rejected $select={select!r}; fetching all columns instead")
+            _REJECTED_SELECTS.add(select)
+    return _http_get_chunked(params)
+
+
 @MCP.resource("schema://incidents")
 def get_schema() -> str:
-    schema = {
-        "source": SODA_URL,
-        "notes": "Field names are defined by the Socrata dataset and may evolve. Use fetch_incidents() to inspect live keys.",
-        "expected_common_fields": [
-            "incident_type",
-            "report_date",
-            "offense_date",
-            "case_number",
-            "location",
-            "latitude",
-            "longitude",
-            "status",
-        ],
-        "pagination": {
-            "limit_param": "$limit",
-            "offset_param": "$offset",
-            "max_limit": 2000,
-        },
-    }
-    return json.dumps(schema, indent=2)
+    return _SCHEMA_JSON
 
 
 @MCP.tool()
@@ -72,19 +218,17 @@ def fetch_incidents(limit: int = 100, offset: int = 0) -> str:
       - on success: JSON list of rows
       - on error: {"ok": false, "error": "..."}
     """
-    if limit <= 0:
-        return json.dumps({"ok": False, "error": "limit must be > 0"})
-    if limit > 2000:
-        return json.dumps({"ok": False, "error": "limit too large (max 2000)"})
+    if not 1 <= limit <= MAX_LIMIT:
+        return _ERR_LIMIT
     if offset < 0:
-        return json.dumps({"ok": False, "error": "offset must be >= 0"})
+        return _ERR_OFFSET
 
     params = {"$limit": limit, "$offset": offset}
     try:
-        data = _http_get(params)
-        return json.dumps(data)
+        data = _http_get_select(params)
+        return orjson.dumps(data).decode()
     except Exception as e:
-        return json.dumps({"ok": False, "error": str(e)})
+        return orjson.dumps({"ok": False, "error": str(e)}).decode()
 
 
 @MCP.tool()
@@ -92,25 +236,20 @@ def get_incident_types(limit: int = 200, offset: int = 0) -> str:
     """
     Return a deduplicated list of incident/narrative types.
     """
-    if limit <= 0:
-        return json.dumps({"ok": False, "error": "limit must be > 0"})
-    if limit > 2000:
-        return json.dumps({"ok": False, "error": "limit too large (max 2000)"})
+    if not 1 <= limit <= MAX_LIMIT:
+        return _ERR_LIMIT
     if offset < 0:
-        return json.dumps({"ok": False, "error": "offset must be >= 0"})
+        return _ERR_OFFSET
 
     params = {"$limit": limit, "$offset": offset}
     try:
-        rows = _http_get(params)
-        types = set()
-        for r in rows:
-            # Dataset varies; tests use "narrative"
-            val = r.get("incident_type") or r.get("narrative")
-            if isinstance(val, str) and val.strip():
-                types.add(val.strip())
-        return json.dumps(sorted(types))
+        rows = _http_get_select(params, "narrative")
+        vals = (r.get("narrative") for r in rows)
+        types = {v.strip() for v in vals if isinstance(v, str)}
+        types.discard("")
+        return orjson.dumps(sorted(types)).decode()
     except Exception as e:
-        return json.dumps({"ok": False, "error": str(e)})
+        return orjson.dumps({"ok": False, "error": str(e)}).decode()
 
 
 @MCP.tool()
@@ -123,21 +262,46 @@ def fetch_by_date_range(
     """
     Fetch incidents within a date range using Socrata $where.
     """
-    if limit <= 0:
-        return json.dumps({"ok": False, "error": "limit must be > 0"})
-    if limit > 2000:
-        return json.dumps({"ok": False, "error": "limit too large (max 2000)"})
+    if not 1 <= limit <= MAX_LIMIT:
+        return _ERR_LIMIT
     if offset < 0:
-        return json.dumps({"ok": False, "error": "offset must be >= 0"})
+        return _ERR_OFFSET
 
     where = f"report_date between '{start_iso}' and '{end_iso}'"
     params = {"$where": where, "$limit": limit, "$offset": offset}
 
+    try:
+        rows = _http_get_select(params)
+        return orjson.dumps(rows).decode()
+    except Exception as e:
+        return orjson.dumps({"ok": False, "error": str(e)}).decode()
+
+
+@MCP.tool()
+def aggregate_incidents(group_by: str = "narrative", limit: int = 100) -> str:
+    """
+    Count incidents per value of one column, computed server-side by Socrata ($group).
+    Returns a JSON list of {<group_by>: value, "n": count} sorted by n desc,
+    so summaries don't need to download every row.
+    """
+    if group_by not in AGGREGATE_COLUMNS:
+        return orjson.dumps({"ok": False, "error": f"group_by must be one of {list(AGGREGATE_COLUMNS)}"}).decode()
+    if not 1 <= limit <= MAX_LIMIT:
+        return _ERR_LIMIT
+
+    params = {
+        "$select": f"{group_by}, count(*) AS n",
+        "$group": group_by,
+        "$order": "n DESC",
+        "$limit": limit,
+    }
     try:
         rows = _http_get(params)
-        return json.dumps(rows)
+        # Socrata returns aggregates as strings
+        out = [{group_by: r.get(group_by), "n": int(r.get("n", 0))} for r in rows]
+        return orjson.dumps(out).decode()
     except Exception as e:
-        return json.dumps({"ok": False, "error": str(e)})
+        return orjson.dumps({"ok": False, "error": str(e)}).decode()
 
 
 if __name__ == "__main__":
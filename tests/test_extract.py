@@ -1,16 +1,72 @@
+import io
 import json
 import requests
 from unittest.mock import patch, Mock
-from servers.extract_server import fetch_incidents
+from servers.extract_server import aggregate_incidents, fetch_incidents
 
-@patch("servers.extract_server.requests.get")
+@patch("servers.extract_server._SESSION.get")
 def test_fetch_incidents_ok(mock_get):
     m = Mock()
     m.raise_for_status.return_value = None
-    m.json.return_value = [{"case_number": "123"}]
+    m.content = b'[{"case_number": "123"}]'
     mock_get.return_value = m
 
     out = fetch_incidents(limit=1, offset=0)
     rows = json.loads(out)
     assert isinstance(rows, list)
     assert rows[0]["case_number"] == "123"
+    assert "narrative" in mock_get.call_args.kwargs["params"]["$select"].split(",")
+    assert mock_get.call_args.kwargs["params"]["$order"] == ":id"
+
+@patch("servers.extract_server._SESSION.get")
+def test_fetch_incidents_large_limit_streams(mock_get):
+    m = Mock()
+    m.raise_for_status.return_value = None
+    m.raw = io.BytesIO(json.dumps([{"case_number": str(i)} for i in range(1000)]).encode())
+    mock_get.return_value = m
+
+    rows = json.loads(fetch_incidents(limit=1000, offset=0))
+    assert len(rows) == 1000
+    assert mock_get.call_args.kwargs["stream"] is True
+
+@patch("servers.extract_server._SESSION.get")
+def test_fetch_incidents_large_limit_falls_back_to_content(mock_get):
+    # no .raw stream, only the buffered body
+    m = Mock(spec=["raise_for_status", "content", "close"])
+    m.raise_for_status.return_value = None
+    m.content = json.dumps([{"case_number": str(i)} for i in range(600)]).encode()
+    mock_get.return_value = m
+
+    rows = json.loads(fetch_incidents(limit=600, offset=0))
+    assert len(rows) == 600
+
+@patch("servers.extract_server._SESSION.get")
+def test_aggregate_incidents_groups_server_side(mock_get):
+    m = Mock()
+    m.raise_for_status.return_value = None
+    m.content = b'[{"narrative": "Theft", "n": "7"}]'
+    mock_get.return_value = m
+
+    rows = json.loads(aggregate_incidents())
+    assert rows == [{"narrative": "Theft", "n": 7}]
+    assert mock_get.call_args.kwargs["params"]["$group"] == "narrative"
+
+    bad = json.loads(aggregate_incidents("1; DROP"))
+    assert bad["ok"] is False
+
+@patch("servers.extract_server._SESSION.get")
+def test_fetch_incidents_splits_large_limit_into_pages(mock_get):
+    def page(url, params, **kwargs):
+        start = params["$offset"]
+        body = json.dumps([{"case_number": str(i)} for i in range(start, start + params["$limit"])]).encode()
+        m = Mock()
+        m.raise_for_status.return_value = None
+        m.raw = io.BytesIO(body)
+        m.content = body
+        return m
+
+    mock_get.side_effect = page
+
+    rows = json.loads(fetch_incidents(limit=1500, offset=0))
+    assert [r["case_number"] for r in rows] == [str(i) for i in range(1500)]
+    assert sorted(c.kwargs["params"]["$offset"] for c in mock_get.call_args_list) == [0, 1000]
@@ -15,3 +15,32 @@ def test_save_and_query(tmp_path, monkeypatch):
 
     summ = json.loads(generate_summary("incidents"))
     assert summ["total_rows"] == 1
+
+
+def test_summary_tracks_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr("servers.load_server.DB_PATH", tmp_path / "incidents.db")
+
+    save_to_sqlite(json.dumps([{"incident_type": "X"}]), "incidents")
+    assert json.loads(generate_summary("incidents"))["total_rows"] == 1
+
+    save_to_sqlite(json.dumps([{"incident_type": "X"}, {"incident_type": "Y"}]), "incidents")
+    assert json.loads(generate_summary("incidents"))["total_rows"] == 2
+
+
+def test_summary_failure_not_cached(tmp_path, monkeypatch):
+    from servers.load_server import _summary_cached
+
+    monkeypatch.setattr("servers.load_server.DB_PATH", tmp_path / "incidents.db")
+
+    save_to_sqlite(json.dumps([{"incident_type": "X"}]), "incidents")
+    assert json.loads(generate_summary("missing"))["ok"] is False
+    assert _summary_cached.cache_info().currsize == 0
+
+
+def test_query_database_stays_read_only(tmp_path, monkeypatch):
+    monkeypatch.setattr("servers.load_server.DB_PATH", tmp_path / "incidents.db")
+
+    save_to_sqlite(json.dumps([{"incident_type": "X"}]), "incidents")
+    query_database("PRAGMA query_only=0")
+    assert "error" in json.loads(query_database("DROP TABLE incidents"))[0]
+    assert json.loads(query_database("SELECT COUNT(*) AS n FROM incidents"))[0]["n"] == 1
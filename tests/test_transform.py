@@ -1,4 +1,5 @@
 import json
+import pytest
 from servers.transform_server import clean_dates, categorize_incidents, detect_anomalies
 
 def test_clean_dates_adds_parsed_fields():
@@ -15,3 +16,27 @@ def test_detect_anomalies_returns_report():
     data = json.dumps([{"incident_type": ""}])
     report = json.loads(detect_anomalies(data))
     assert "total_rows" in report
+
+def test_oversized_input_rejected(monkeypatch):
+    monkeypatch.setattr("servers.transform_server.MAX_CELLS", 3)
+    data = json.dumps([{"incident_type": "X", "narrative": "y"}] * 2)
+    with pytest.raises(ValueError, match="too large"):
+        clean_dates(data)
+
+def test_categorize_incidents_first_matching_rule_wins():
+    rows = [{"narrative": "Burglary"}, {"narrative": "hit and run"}, {"narrative": "Noise complaint"}]
+    out = json.loads(categorize_incidents(json.dumps(rows), []))
+    assert [r["category"] for r in out] == ["theft/property", "traffic", "other"]
+
+    out = json.loads(categorize_incidents(json.dumps(rows[:1]), ["burglary"]))
+    assert out[0]["category"] == "burglary"
+
+def test_clean_dates_parses_socrata_timestamps():
+    rows = [
+        {"report_date": "2026-02-16T23:15:00.000", "offense_date": "2026-02-16T23:15:00"},
+        {"report_date": "2026-02-16T23:15:00.5", "offense_date": "not a date"},
+        {"report_date": "2026-02-16T23:15:00.1234567", "offense_date": "2026-2-16T23:15:00"},
+    ]
+    out = json.loads(clean_dates(json.dumps(rows)))
+    assert [r["report_date_parsed"] for r in out] == ["2026-02-16T23:15:00", "2026-02-16T23:15:00.500000", None]
+    assert [r["offense_date_parsed"] for r in out] == ["2026-02-16T23:15:00", None, "2026-02-16T23:15:00"]